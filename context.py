@@ -34,7 +34,7 @@ class LiccoAuthnz(FlaskAuthnz):
         if prjid and priv_name in ["write", "edit"]:            
             logged_in_user = super().get_current_user_id()
             oid = ObjectId(prjid)
-            prj = licco_db["lineconfigdb"]["projects"].find_one({"_id": oid})
+            prj = licco_db["lineconfigdb"]["projects"].find_one({"_id": oid}, {"owner": 1, "editors": 1})
             if prj and (prj["owner"] == logged_in_user) or logged_in_user in prj.get("editors", []):
                 return True
         return False
@@ -52,7 +52,7 @@ class LiccoAuthnz(FlaskAuthnz):
             @wraps(f)
             def wrapped(*args, **kwargs):
                 prjid = kwargs.get('prjid', None)
-                logger.info("Looking to authorize %s for app %s for privilege %s for project %s" % (self.get_current_user_id(), self.application_name, priv_name, prjid))
+                logger.info("Looking to authorize %s for app %s for privilege %s for project %s", self.get_current_user_id(), self.application_name, priv_name, prjid)
                 if not self.check_privilege_for_project(priv_name, prjid):
                     abort(403)
                 return f(*args, **kwargs)
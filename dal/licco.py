@@ -9,12 +9,11 @@ from enum import Enum
 import copy
 import json
 import math
-import pytz
 import tempfile
 
 from bson import ObjectId
-from pymongo import ASCENDING, DESCENDING
-from pymongo.errors import PyMongoError
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError, BulkWriteError
 
 from context import licco_db
 
@@ -23,6 +22,8 @@ from .projdetails import get_project_attributes, get_all_project_changes
 __author__ = 'mshankar@slac.stanford.edu'
 
 line_config_db_name = "lineconfigdb"
+# Bump this whenever the indexes in initialize_collections change
+indexes_version = 2
 logger = logging.getLogger(__name__)
 
 
@@ -38,21 +39,25 @@ class FCState(Enum):
     Removed = "Removed"
 
     def describe(self):
-        return descriptions[self]
+        return fcstate_descriptions[self]
 
     @classmethod
     def descriptions(cls):
-        return {
-            FCState.Conceptual: {"sortorder": 0, "label": "Conceptual", "description": "There are no firm plans to proceed with applying this configuration, it is still under heavy development. Configuration changes are frequent."},
-            FCState.Planned: {"sortorder": 1, "label": "Planned", "description": "A planned configuration, installation planning is underway. Configuration changes are less frequent."},
-            FCState.ReadyForInstallation: {"sortorder": 2, "label": "Ready for installation", "description": "Configuration is designated as ready for installation. Installation is imminent. Installation effort is planned and components may be fully assembled and bench-tested."},
-            FCState.Installed: {"sortorder": 3, "label": "Installed", "description": "Component is physically installed but not fully operational"},
-            FCState.Commissioned: {"sortorder": 4, "label": "Commissioned", "description": "Component is commissioned."},
-            FCState.Operational: {"sortorder": 5, "label": "Operational", "description": "Component is operational, commissioning and TTO is complete"},
-            FCState.NonOperational: {"sortorder": 6, "label": "Non-operational", "description": "Component remains installed but is slated for removal"},
-            FCState.Decommissioned: {"sortorder": 7, "label": "De-commissioned", "description": "Component is de-commissioned."},
-            FCState.Removed: {"sortorder": 8, "label": "Removed", "description": "Component is no longer a part of the configuration, record is maintained"},
-        }
+        return fcstate_descriptions
+
+
+# The descriptions are fixed, so they are built once rather than on every call
+fcstate_descriptions = {
+    FCState.Conceptual: {"sortorder": 0, "label": "Conceptual", "description": "There are no firm plans to proceed with applying this configuration, it is still under heavy development. Configuration changes are frequent."},
+    FCState.Planned: {"sortorder": 1, "label": "Planned", "description": "A planned configuration, installation planning is underway. Configuration changes are less frequent."},
+    FCState.ReadyForInstallation: {"sortorder": 2, "label": "Ready for installation", "description": "Configuration is designated as ready for installation. Installation is imminent. Installation effort is planned and components may be fully assembled and bench-tested."},
+    FCState.Installed: {"sortorder": 3, "label": "Installed", "description": "Component is physically installed but not fully operational"},
+    FCState.Commissioned: {"sortorder": 4, "label": "Commissioned", "description": "Component is commissioned."},
+    FCState.Operational: {"sortorder": 5, "label": "Operational", "description": "Component is operational, commissioning and TTO is complete"},
+    FCState.NonOperational: {"sortorder": 6, "label": "Non-operational", "description": "Component remains installed but is slated for removal"},
+    FCState.Decommissioned: {"sortorder": 7, "label": "De-commissioned", "description": "Component is de-commissioned."},
+    FCState.Removed: {"sortorder": 8, "label": "Removed", "description": "Component is no longer a part of the configuration, record is maintained"},
+}
 
 
 class UDLR(Enum):
@@ -63,39 +68,55 @@ class UDLR(Enum):
 
 
 def initialize_collections():
-    if 'name_1' not in licco_db[line_config_db_name]["projects"].index_information().keys():
-        licco_db[line_config_db_name]["projects"].create_index(
-            [("name", ASCENDING)], unique=True, name="name_1")
-    if 'owner_1' not in licco_db[line_config_db_name]["projects"].index_information().keys():
-        licco_db[line_config_db_name]["projects"].create_index(
-            [("owner", ASCENDING)], name="owner_1")
-    if 'editors_1' not in licco_db[line_config_db_name]["projects"].index_information().keys():
-        licco_db[line_config_db_name]["projects"].create_index(
-            [("editors", ASCENDING)], name="editors_1")
-    if 'name_1' not in licco_db[line_config_db_name]["fcs"].index_information().keys():
-        licco_db[line_config_db_name]["fcs"].create_index(
-            [("name", ASCENDING)], unique=True, name="name_1")
-    if 'name_1' not in licco_db[line_config_db_name]["fgs"].index_information().keys():
-        licco_db[line_config_db_name]["fgs"].create_index(
-            [("name", ASCENDING)], unique=True, name="name_1")
-    if 'fc_fg_1' not in licco_db[line_config_db_name]["ffts"].index_information().keys():
-        licco_db[line_config_db_name]["ffts"].create_index(
-            [("fc", ASCENDING), ("fg", ASCENDING)], unique=True, name="fc_fg_1")
-    if 'prj_time_1' not in licco_db[line_config_db_name]["projects_history"].index_information().keys():
-        licco_db[line_config_db_name]["projects_history"].create_index(
-            [("prj", ASCENDING), ("time", DESCENDING)], name="prj_time_1")
-    if 'prj_fc_time_1' not in licco_db[line_config_db_name]["projects_history"].index_information().keys():
-        licco_db[line_config_db_name]["projects_history"].create_index(
-            [("prj", ASCENDING), ("fft", ASCENDING), ("time", DESCENDING)], name="prj_fft_time_1")
-    if 'sw_time_1' not in licco_db[line_config_db_name]["switch"].index_information().keys():
-        licco_db[line_config_db_name]["switch"].create_index(
-            [("switch_time", DESCENDING)], unique=True, name="sw_time_1")
-    if 'name_prj_1' not in licco_db[line_config_db_name]["tags"].index_information().keys():
-        licco_db[line_config_db_name]["tags"].create_index(
-            [("name", ASCENDING), ("prj", ASCENDING)], unique=True, name="name_prj_1")
-    if 'app_1_name_1' not in licco_db[line_config_db_name]["roles"].index_information().keys():
-        licco_db[line_config_db_name]["roles"].create_index(
-            [("app", ASCENDING), ("name", ASCENDING)], unique=True, name="app_1_name_1")
+    """
+    Create the indexes we need; one createIndexes command per collection.
+    The server skips the indexes that already exist with the same name and keys.
+    Once a given indexes_version has been applied, a marker document lets later startups skip this entirely.
+    """
+    marker = {"_id": "indexes", "version": indexes_version}
+    if licco_db[line_config_db_name]["_meta"].find_one(marker, {"_id": 1}):
+        return
+    collection_indexes = {
+        "projects": [
+            IndexModel([("name", ASCENDING)], unique=True, name="name_1"),
+            IndexModel([("owner", ASCENDING)], name="owner_1"),
+            IndexModel([("editors", ASCENDING)], name="editors_1"),
+            # For get_currently_approved_project
+            IndexModel([("status", ASCENDING)], name="status_1")
+        ],
+        "fcs": [
+            IndexModel([("name", ASCENDING)], unique=True, name="name_1")
+        ],
+        "fgs": [
+            IndexModel([("name", ASCENDING)], unique=True, name="name_1")
+        ],
+        "ffts": [
+            IndexModel([("fc", ASCENDING), ("fg", ASCENDING)], unique=True, name="fc_fg_1"),
+            # The fc_fg_1 prefix covers the lookups by fc; this one is for the FG in-use check
+            IndexModel([("fg", ASCENDING)], name="fg_1")
+        ],
+        "projects_history": [
+            IndexModel([("prj", ASCENDING), ("time", DESCENDING)], name="prj_time_1"),
+            IndexModel([("prj", ASCENDING), ("fft", ASCENDING), ("time", DESCENDING)], name="prj_fft_time_1"),
+            # For the most recent change across all projects; used to keep modification times monotonic
+            IndexModel([("time", DESCENDING)], name="time_1"),
+            # For the FFT in-use checks, which are not scoped to a project
+            IndexModel([("fft", ASCENDING)], name="fft_1")
+        ],
+        "switch": [
+            IndexModel([("switch_time", DESCENDING)], unique=True, name="sw_time_1")
+        ],
+        "tags": [
+            IndexModel([("name", ASCENDING), ("prj", ASCENDING)], unique=True, name="name_prj_1")
+        ],
+        "roles": [
+            IndexModel([("app", ASCENDING), ("name", ASCENDING)], unique=True, name="app_1_name_1"),
+            IndexModel([("players", ASCENDING), ("app", ASCENDING)], name="players_1_app_1")
+        ]
+    }
+    for collection, indexes in collection_indexes.items():
+        licco_db[line_config_db_name][collection].create_indexes(indexes)
+    licco_db[line_config_db_name]["_meta"].replace_one({"_id": "indexes"}, marker, upsert=True)
 
 
 def get_all_users():
@@ -119,11 +140,11 @@ def get_fft_name_by_id(fftid):
     :return: Tuple of string names FC, FG
     """
     fft = licco_db[line_config_db_name]["ffts"].find_one(
-        {"_id": ObjectId(fftid)})
+        {"_id": ObjectId(fftid)}, {"fc": 1, "fg": 1})
     fc = licco_db[line_config_db_name]["fcs"].find_one(
-        {"_id": fft["fc"]})
+        {"_id": fft["fc"]}, {"name": 1})
     fg = licco_db[line_config_db_name]["fgs"].find_one(
-        {"_id": fft["fg"]}) 
+        {"_id": fft["fg"]}, {"name": 1})
     return fc["name"], fg["name"]
 
 def get_fft_id_by_names(fc, fg):
@@ -134,11 +155,11 @@ def get_fft_id_by_names(fc, fg):
     :return: Tuple of ids FC, FG
     """
     fc_obj = licco_db[line_config_db_name]["fcs"].find_one(
-        {"name": fc})
+        {"name": fc}, {"_id": 1})
     fg_obj = licco_db[line_config_db_name]["fgs"].find_one(
-        {"name": fg}) 
+        {"name": fg}, {"_id": 1})
     fft = licco_db[line_config_db_name]["ffts"].find_one(
-        {"fc": ObjectId(fc_obj["_id"]), "fg": ObjectId(fg_obj["_id"])})
+        {"fc": ObjectId(fc_obj["_id"]), "fg": ObjectId(fg_obj["_id"])}, {"_id": 1})
     return fft["_id"]
 
 def get_users_with_privilege(privilege):
@@ -152,7 +173,7 @@ def get_users_with_privilege(privilege):
         for player in role.get("players", []):
             if player.startswith("uid:"):
                 ret.add(player.replace("uid:", ""))
-    return sorted(list(ret))
+    return sorted(ret)
 
 
 def get_fft_values_by_project(fftid, prjid):
@@ -186,11 +207,9 @@ def get_projects_for_user(username):
     :param username - the userid of the user from authn
     :return: List of projects
     """
-    owned_projects = list(
-        licco_db[line_config_db_name]["projects"].find({"owner": username}))
-    editable_projects = list(
-        licco_db[line_config_db_name]["projects"].find({"editors": username}))
-    return owned_projects + editable_projects
+    projects = list(licco_db[line_config_db_name]["projects"].find(
+        {"$or": [{"owner": username}, {"editors": username}]}))
+    return projects
 
 
 def get_project(id):
@@ -244,10 +263,9 @@ def delete_fc(fcid):
     Delete an FC if it is not currently being used by any FFT.
     """
     fcid = ObjectId(fcid)
-    fcs_used = set(licco_db[line_config_db_name]["ffts"].distinct("fc"))
-    if fcid in fcs_used:
+    if licco_db[line_config_db_name]["ffts"].find_one({"fc": fcid}, {"_id": 1}):
         return False, "This FC is being used by an FFT", None
-    logger.info(f"Deleting FC with id {str(fcid)}")
+    logger.info("Deleting FC with id %s", fcid)
     licco_db[line_config_db_name]["fcs"].delete_one({"_id": fcid})
     return True, "", None
 
@@ -269,10 +287,9 @@ def delete_fg(fgid):
     Delete an FG if it is not currently being used by any FFT.
     """
     fgid = ObjectId(fgid)
-    fgs_used = set(licco_db[line_config_db_name]["ffts"].distinct("fg"))
-    if fgid in fgs_used:
+    if licco_db[line_config_db_name]["ffts"].find_one({"fg": fgid}, {"_id": 1}):
         return False, "This FG is being used by an FFT", None
-    logger.info("Deleting FG with id " + str(fgid))
+    logger.info("Deleting FG with id %s", fgid)
     licco_db[line_config_db_name]["fgs"].delete_one({"_id": fgid})
     return True, "", None
 
@@ -302,21 +319,27 @@ def delete_fft(fftid):
     Delete an FFT if it is not currently being used by any project.
     """
     fftid = ObjectId(fftid)
-    ffts_used = set(licco_db[line_config_db_name]
-                    ["projects_history"].distinct("fft"))
-    if fftid in ffts_used:
+    if licco_db[line_config_db_name]["projects_history"].find_one({"fft": fftid}, {"_id": 1}):
         return False, "This FFT is being used in a project", None
-    logger.info("Deleting FFT with id " + str(fftid))
+    logger.info("Deleting FFT with id %s", fftid)
     licco_db[line_config_db_name]["ffts"].delete_one({"_id": fftid})
     return True, "", None
 
 
+# The attributes that every new project starts out with.
+new_project_template = {
+    "editors": [],
+    "status": "development"
+}
+
+
 def create_new_project(name, description, userid):
     """
     Create a new project belonging to the specified user.
     """
-    newprjid = licco_db[line_config_db_name]["projects"].insert_one({"name": name, "description": description, "owner": userid, "editors": [
-    ], "status": "development", "creation_time": datetime.datetime.utcnow()}).inserted_id
+    newprj = copy.deepcopy(new_project_template)
+    newprj.update({"name": name, "description": description, "owner": userid, "creation_time": datetime.datetime.utcnow()})
+    newprjid = licco_db[line_config_db_name]["projects"].insert_one(newprj).inserted_id
     prj = licco_db[line_config_db_name]["projects"].find_one({"_id": newprjid})
     return prj
 
@@ -368,7 +391,7 @@ def create_new_fft(fc, fg, fcdesc=None, fgdesc=None):
         if not fcdesc:
             return False, f"Could not find functional component {fc}", None
         else:
-            logger.debug(f"Creating a new FC as part of creating an FFT {fc}")
+            logger.debug("Creating a new FC as part of creating an FFT %s", fc)
             _, _, fcobj = create_new_functional_component(fc, fcdesc)
     if not fg:
         fg = ""
@@ -378,7 +401,7 @@ def create_new_fft(fc, fg, fcdesc=None, fgdesc=None):
         if not fgdesc:
             return False, f"Could not find fungible token with id {fg}", None
         else:
-            logger.debug(f"Creating a new FG as part of creating an FFT {fg}")
+            logger.debug("Creating a new FG as part of creating an FFT %s", fg)
             _, _, fgobj = create_new_fungible_token(fg, fgdesc)
     if licco_db[line_config_db_name]["ffts"].find_one({"fc": ObjectId(fcobj["_id"]), "fg": fgobj["_id"]}):
         return False, f"FFT with {fc}-{fg} has already been registered", None
@@ -396,6 +419,54 @@ def create_new_fft(fc, fg, fcdesc=None, fgdesc=None):
         return False, str(e), None
 
 
+def create_new_ffts(fcfgs):
+    """
+    Create FFTs in bulk for an iterable of (fc name, fg name) pairs.
+    Unlike create_new_fft, the FCs and FGs must already exist; the only exception is the default null fg, which is created if needed.
+    Returns a dict of (fc name, fg name) to the FFT id for all the pairs that could be registered.
+    """
+    fcfgs = set(fcfgs)
+    if not fcfgs:
+        return {}
+    if any(not fg for _, fg in fcfgs) and not licco_db[line_config_db_name]["fgs"].find_one({"name": ""}):
+        create_new_fungible_token("", "The default null fg to accommodate outer joins")
+    fc2id = {x["name"]: x["_id"] for x in licco_db[line_config_db_name]["fcs"].find(
+        {"name": {"$in": [fc for fc, _ in fcfgs]}}, {"name": 1})}
+    fg2id = {x["name"]: x["_id"] for x in licco_db[line_config_db_name]["fgs"].find(
+        {"name": {"$in": [fg if fg else "" for _, fg in fcfgs]}}, {"name": 1})}
+
+    # Several name pairs can resolve to the same FFT; for example, an fg of "" and of None
+    new_ffts = collections.defaultdict(list)
+    for fc, fg in fcfgs:
+        if fc not in fc2id or (fg if fg else "") not in fg2id:
+            logger.error("Cannot create FFT %s-%s as the FC or FG does not exist", fc, fg)
+            continue
+        new_ffts[(fc2id[fc], fg2id[fg if fg else ""])].append((fc, fg))
+    if not new_ffts:
+        return {}
+
+    try:
+        try:
+            licco_db[line_config_db_name]["ffts"].insert_many(
+                [{"fc": fcid, "fg": fgid} for fcid, fgid in new_ffts.keys()], ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            # Duplicate keys are FFTs that were registered in the meantime; the lookup below picks them up as well
+            duplicates = [err for err in write_errors if err.get("code") == 11000]
+            if duplicates:
+                logger.warning("%s of %s FFTs were already registered", len(duplicates), len(new_ffts))
+            # Anything else did not get registered; the lookup below leaves these out so they are reported as failures
+            for err in write_errors:
+                if err.get("code") != 11000:
+                    logger.error("Failed to register FFT %s: %s", err.get("op"), err.get("errmsg"))
+        registered = licco_db[line_config_db_name]["ffts"].find(
+            {"$or": [{"fc": fcid, "fg": fgid} for fcid, fgid in new_ffts.keys()]}, {"fc": 1, "fg": 1})
+        return {fcfg: fft["_id"] for fft in registered for fcfg in new_ffts[(fft["fc"], fft["fg"])]}
+    except PyMongoError as e:
+        logger.error("Failed to register %s FFTs: %s", len(new_ffts), e)
+        return {}
+
+
 def default_wrapper(func, default):
     def wrapped_func(val):
         if val == '':
@@ -554,6 +625,8 @@ fcattrs = {
         "required": False
     }
 }
+# The dimensions that must be known before an FFT can leave the Conceptual state
+required_dimension_attrs = tuple(name for name, meta in fcattrs.items() if meta.get("is_required_dimension") is True)
 
 
 def get_fcattrs(fromstr=False):
@@ -582,45 +655,120 @@ def update_fft_in_project(prjid, fftid, fcupdate, userid, modification_time=None
     if not fft:
         return False, f"Cannot find functional+fungible token for {fftid}", None, None
 
-    current_attrs = get_project_attributes(
-        licco_db[line_config_db_name], ObjectId(prjid)).get(str(fftid), {})
+    # Nothing is written to the project until the very end; so this also serves as the result if nothing changes.
+    project_attrs = get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid))
+    current_attrs = project_attrs.get(str(fftid), {})
 
     if not modification_time:
-        modification_time = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
+        modification_time = datetime.datetime.now(datetime.timezone.utc)
     # Make sure the timestamp on this server is monotonically increasing.
-    latest_changes = list(licco_db[line_config_db_name]["projects_history"].find(
-        {}).sort([("time", -1)]).limit(1))
-    if latest_changes:
-        if modification_time < latest_changes[0]["time"]:
-            return False, f"The time on this server {modification_time.isoformat()} is before the most recent change from the server {latest_changes[0]['time'].isoformat()}", None, None
+    latest_change = licco_db[line_config_db_name]["projects_history"].find_one(
+        {}, {"time": 1}, sort=[("time", -1)])
+    if latest_change:
+        if modification_time < latest_change["time"]:
+            return False, f"The time on this server {modification_time.isoformat()} is before the most recent change from the server {latest_change['time'].isoformat()}", None, None
+
+    status, error_str, all_inserts, insert_count = __fft_history_inserts__(
+        prjid, fftid, fcupdate, userid, current_attrs, modification_time)
+    if status is False and not (insert_count and insert_count["fail"]):
+        # The Conceptual state and required attribute checks do not return the project attributes
+        return status, error_str, None, insert_count
+    if not all_inserts:
+        return status, error_str, project_attrs, insert_count
+    logger.debug("Inserting %s documents into the history",
+                 len(all_inserts))
+    licco_db[line_config_db_name]["projects_history"].insert_many(
+        all_inserts)
+    return True, error_str, get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid)), insert_count
+
 
+def update_multiple_ffts_in_project(prjid, fftupdates, userid, modification_time=None, project_attrs=None, refresh_attrs=True):
+    """
+    Update the value(s) of several FFTs in a project.
+    The project attributes are read once and the history entries for all the FFTs are written with a single insert_many.
+    :param fftupdates - list of (fftid, fcupdate) tuples; these are applied in order
+    :param project_attrs - the current project attributes, if the caller has already fetched them
+    :param refresh_attrs - if False, the project attributes are not read back after the update and None is returned in their place
+    :return: status, errormsg, the project attributes, and a list with the (status, errormsg, insert_count) for each of the fftupdates
+    """
+    prj = licco_db[line_config_db_name]["projects"].find_one(
+        {"_id": ObjectId(prjid)})
+    if not prj:
+        error_str = f"Cannot find project for {prjid}"
+        return False, error_str, None, [(False, error_str, None)] * len(fftupdates)
+
+    if project_attrs is None:
+        project_attrs = get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid))
+
+    if not modification_time:
+        modification_time = datetime.datetime.now(datetime.timezone.utc)
+    # Make sure the timestamp on this server is monotonically increasing.
+    latest_change = licco_db[line_config_db_name]["projects_history"].find_one(
+        {}, {"time": 1}, sort=[("time", -1)])
+    if latest_change:
+        if modification_time < latest_change["time"]:
+            error_str = f"The time on this server {modification_time.isoformat()} is before the most recent change from the server {latest_change['time'].isoformat()}"
+            return False, error_str, project_attrs, [(False, error_str, None)] * len(fftupdates)
+
+    known_ffts = {str(x["_id"]) for x in licco_db[line_config_db_name]["ffts"].find(
+        {"_id": {"$in": [ObjectId(fftid) for fftid, _ in fftupdates]}}, {"_id": 1})}
+    # Values as they will be once the updates so far are applied; so that later updates of the same FFT compare against these
+    current_values = {}
+    # Keyed by fft and attribute; if the same attribute is updated more than once, only the last value is written
+    all_inserts = {}
+    results = []
+    for fftid, fcupdate in fftupdates:
+        if str(fftid) not in known_ffts:
+            results.append((False, f"Cannot find functional+fungible token for {fftid}", None))
+            continue
+        current_attrs = current_values.setdefault(str(fftid), dict(project_attrs.get(str(fftid), {})))
+        status, error_str, inserts, insert_count = __fft_history_inserts__(
+            prjid, fftid, fcupdate, userid, current_attrs, modification_time)
+        for entry in inserts:
+            current_attrs[entry["key"]] = entry["val"]
+            all_inserts[(str(fftid), entry["key"])] = entry
+        results.append((status, error_str, insert_count))
+
+    if not all_inserts:
+        return True, "", project_attrs, results
+    logger.debug("Inserting %s documents into the history",
+                 len(all_inserts))
+    licco_db[line_config_db_name]["projects_history"].insert_many(
+        list(all_inserts.values()))
+    if not refresh_attrs:
+        return True, "", None, results
+    return True, "", get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid)), results
+
+
+def __fft_history_inserts__(prjid, fftid, fcupdate, userid, current_attrs, modification_time):
+    """
+    Validate the update of an FFT against its current attributes and work out the history entries for the attributes that change.
+    Nothing is written to the database.
+    :return: status (None if nothing changes), errormsg, the list of history entries and the insert count
+    """
     if "state" in fcupdate and fcupdate["state"] != "Conceptual":
-        for attrname, attrmeta in fcattrs.items():
-            if (attrmeta.get("is_required_dimension") is True) and ((current_attrs.get(attrname, None) is None) and (fcupdate[attrname] is None)):
-                return False, "FFTs should remain in the Conceptual state while the dimensions are still being determined.", None, None
+        for attrname in required_dimension_attrs:
+            if (current_attrs.get(attrname, None) is None) and (fcupdate[attrname] is None):
+                return False, "FFTs should remain in the Conceptual state while the dimensions are still being determined.", [], None
 
-    error_str = ""
     all_inserts = []
-    fft_edits = set()
     insert_count = {"success": 0, "fail": 0, "ignored": 0}
     for attrname, attrval in fcupdate.items():
         if attrname == "fft":
             continue
         attrmeta = fcattrs[attrname]
         if attrmeta["required"] and not attrval:
-            return False, f"Parameter {attrname} is a required attribute", None, insert_count
+            return False, f"Parameter {attrname} is a required attribute", [], insert_count
         try:
             newval = attrmeta["fromstr"](attrval)
         except ValueError:
             # <FFT>, <field>, invalid input rejected: [Wrong type| Out of range]
             insert_count["fail"] += 1
-            error_str = f"Wrong type - {attrname}, {attrval}"
-            break
+            return False, f"Wrong type - {attrname}, {attrval}", [], insert_count
         # Check that values are within bounds
         if not validate_insert_range(attrname, newval):
             insert_count["fail"] += 1
-            error_str = f"Value out of range - {attrname}, {attrval}"
-            break
+            return False, f"Value out of range - {attrname}, {attrval}", [], insert_count
         prevval = current_attrs.get(attrname, None)
         if prevval != newval:
             all_inserts.append({
@@ -631,51 +779,43 @@ def update_fft_in_project(prjid, fftid, fcupdate, userid, modification_time=None
                 "user": userid,
                 "time": modification_time
             })
-            fft_edits.add(ObjectId(fftid))
-
-    #If one of the fields is invalid, and we have an error
-    if error_str != "":
-        return False, error_str, get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid)), insert_count
-    if all_inserts:
-        logger.debug("Inserting %s documents into the history",
-                     len(all_inserts))
-        insert_count["success"] +=1
-        licco_db[line_config_db_name]["projects_history"].insert_many(
-            all_inserts)
-    else:
-        insert_count["ignored"] +=1
-        logger.debug("In update_fft_in_project, all_inserts is an empty list")
-        error_str = "No changes detected."
-        return None, error_str, get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid)), insert_count
-    return True, error_str, get_project_attributes(licco_db[line_config_db_name], ObjectId(prjid)), insert_count
+
+    if not all_inserts:
+        insert_count["ignored"] += 1
+        logger.debug("No changes detected for FFT %s in project %s", fftid, prjid)
+        return None, "No changes detected.", [], insert_count
+    insert_count["success"] += 1
+    return True, "", all_inserts, insert_count
+
+
+# The attributes whose values are range checked, as (conversion, lower bound, upper bound).
+# Bounds are inclusive; use math.inf for an open end so every check is a single chained comparison.
+fcattr_ranges = {
+    "ray_trace": (int, 0, math.inf),
+    "nom_loc_z": (float, 0, 2000),
+    "nom_ang_x": (float, -math.pi, math.pi),
+    "nom_ang_y": (float, -math.pi, math.pi),
+    "nom_ang_z": (float, -math.pi, math.pi)
+}
 
 
 def validate_insert_range(attr, val):
     """
     Helper function to validate data prior to being saved in DB
     """
+    # empty values are valid, catch before other verifications
+    if attr not in fcattr_ranges or val == '' or val is None:
+        return True
+    convert, lower, upper = fcattr_ranges[attr]
     try:
-        if attr == "ray_trace":
-            if val == '' or val is None:
-                return True
-            return bool(int(val) >= 0)
-        # empty strings valid for angles, catch before other verifications
-        if "nom" in attr:
-            if val == "":
-                return True
-            if attr == "nom_loc_z":
-                if float(val) < 0 or float(val) > 2000:
-                    return False
-            if "nom_ang_" in attr:
-                if (float(val) > math.pi) or (float(val) < -(math.pi)):
-                    return False
+        val = convert(val)
     except ValueError:
-        logger.debug(f'Value {val} wrong type for attribute {attr}.')
+        logger.debug('Value %s wrong type for attribute %s.', val, attr)
         return False
     except TypeError:
-        logger.debug(f'Value {val} not verified for attribute {attr}.')
+        logger.debug('Value %s not verified for attribute %s.', val, attr)
         return False
-    return True
+    return lower <= val <= upper
 
 
 def copy_ffts_from_project(srcprjid, destprjid, fftid, attrnames, userid):
@@ -695,13 +835,13 @@ def copy_ffts_from_project(srcprjid, destprjid, fftid, attrnames, userid):
     if not fft:
         return False, f"Cannot find FFT for {fftid}", None
 
-    modification_time = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
+    modification_time = datetime.datetime.now(datetime.timezone.utc)
     # Make sure the timestamp on this server is monotonically increasing.
-    latest_changes = list(licco_db[line_config_db_name]["projects_history"].find(
-        {}).sort([("time", -1)]).limit(1))
-    if latest_changes:
-        if modification_time < latest_changes[0]["time"]:
-            return False, f"The time on this server {modification_time.isoformat()} is before the most recent change from the server {latest_changes[0]['time'].isoformat()}", None
+    latest_change = licco_db[line_config_db_name]["projects_history"].find_one(
+        {}, {"time": 1}, sort=[("time", -1)])
+    if latest_change:
+        if modification_time < latest_change["time"]:
+            return False, f"The time on this server {modification_time.isoformat()} is before the most recent change from the server {latest_change['time'].isoformat()}", None
 
     current_attrs = get_project_attributes(
         licco_db[line_config_db_name], ObjectId(destprjid))
@@ -710,6 +850,8 @@ def copy_ffts_from_project(srcprjid, destprjid, fftid, attrnames, userid):
         licco_db[line_config_db_name], ObjectId(srcprjid))
     oattrs = other_attrs.get(fftid, {})
 
+    # Membership is tested for every attribute of the FFT
+    attrnames = set(attrnames)
     all_inserts = []
     for attrname, cnvattrval in oattrs.items():
         if not attrname in attrnames:
@@ -729,6 +871,9 @@ def copy_ffts_from_project(srcprjid, destprjid, fftid, attrnames, userid):
                 "user": userid,
                 "time": modification_time
             })
+    if not all_inserts:
+        # Nothing to copy; the destination values are already current
+        return True, "", fftattrs
     licco_db[line_config_db_name]["projects_history"].insert_many(all_inserts)
 
     return True, "", get_project_attributes(licco_db[line_config_db_name], ObjectId(destprjid)).get(fftid, {})
@@ -745,8 +890,11 @@ def submit_project_for_approval(prjid, userid, approver):
         return False, f"Cannot find project for {prjid}", None
     if prj["status"] != "development":
         return False, f"Project {prjid} is not in development status", None
-    licco_db[line_config_db_name]["projects"].update_one({"_id": prj["_id"]}, {"$set": {
+    # Only move out of development if no one else has in the meantime
+    res = licco_db[line_config_db_name]["projects"].update_one({"_id": prj["_id"], "status": "development"}, {"$set": {
                                                          "status": "submitted", "submitter": userid, "approver": approver, "submitted_time": datetime.datetime.utcnow()}})
+    if not res.matched_count:
+        return False, f"Project {prjid} is not in development status", None
     return True, "", prj
 
 
@@ -757,19 +905,25 @@ def approve_project(prjid, userid):
     """
     prj = licco_db[line_config_db_name]["projects"].find_one(
         {"_id": ObjectId(prjid)})
-    approved = get_currently_approved_project()
     if not prj:
         return False, f"Cannot find project for {prjid}", None
     if prj["status"] != "submitted":
         return False, f"Project {prjid} is not in submitted status", None
     if prj["submitter"] == userid:
         return False, f"Project {prj['name']} cannot be approved by its submitter {userid}. Please ask someone other than the submitter to approve the project", None
+    # Both projects record the same approval time
+    approved_time = datetime.datetime.utcnow()
+    approved = get_currently_approved_project()
+    if not approved:
+        return False, f"Project {prj['name']} cannot be approved as there is no approved project to merge it into", None
+    # change the project status to development instead of submitted; only if it has not already been approved or rejected
+    res = licco_db[line_config_db_name]["projects"].update_one({"_id": prj["_id"], "status": "submitted"}, {"$set": {
+                                                         "status": "development", "approver": userid, "approved_time": approved_time}})
+    if not res.matched_count:
+        return False, f"Project {prjid} is not in submitted status", None
     # update the most recent approved time
     licco_db[line_config_db_name]["projects"].update_one({"_id": approved["_id"]}, {"$set": {
-                                                         "approver": userid, "approved_time": datetime.datetime.utcnow()}})
-    # change the project status to development instead of submitted
-    licco_db[line_config_db_name]["projects"].update_one({"_id": prj["_id"]}, {"$set": {
-                                                         "status": "development", "approver": userid, "approved_time": datetime.datetime.utcnow()}})
+                                                         "approver": userid, "approved_time": approved_time}})
     return True, f"Project {prj['name']} approved by {prj['submitter']}.", prj
 
 
@@ -784,8 +938,12 @@ def reject_project(prjid, userid, reason):
         return False, f"Cannot find project for {prjid}", None
     if prj["status"] != "submitted":
         return False, f"Project {prjid} is not in submitted status", None
-    licco_db[line_config_db_name]["projects"].update_one({"_id": prj["_id"]}, {"$set": {
-                                                         "status": "development", "approver": userid, "approved_time": datetime.datetime.utcnow(), "notes": [reason] + prj.get("notes", [])}})
+    # Prepend the reason on the server rather than rewriting the whole notes array
+    res = licco_db[line_config_db_name]["projects"].update_one({"_id": prj["_id"], "status": "submitted"}, {
+        "$set": {"status": "development", "approver": userid, "approved_time": datetime.datetime.utcnow()},
+        "$push": {"notes": {"$each": [reason], "$position": 0}}})
+    if not res.matched_count:
+        return False, f"Project {prjid} is not in submitted status", None
     return True, "", prj
 
 
@@ -794,11 +952,10 @@ def get_currently_approved_project_by_switch():
     Get the current approved project.
     This is really the most recently approved project
     """
-    prjs = list(licco_db[line_config_db_name]["switch"].find(
-        {}).sort([("switch_time", -1)]).limit(1))
-    if prjs:
-        current_id = prjs[0]["prj"]
-        return licco_db[line_config_db_name]["projects"].find_one({"_id": current_id})
+    latest_switch = licco_db[line_config_db_name]["switch"].find_one(
+        {}, {"prj": 1}, sort=[("switch_time", -1)])
+    if latest_switch:
+        return licco_db[line_config_db_name]["projects"].find_one({"_id": latest_switch["prj"]})
     return None
 
 def get_currently_approved_project():
@@ -869,32 +1026,32 @@ def diff_project(prjid, other_prjid, userid, approved=False):
     if not prj:
         return False, f"Cannot find project for {prjid}", None
 
-    otr = licco_db[line_config_db_name]["projects"].find_one(
-        {"_id": ObjectId(other_prjid)})
-    if not otr:
-        return False, f"Cannot find project for {other_prjid}", None
+    # Diffing a project against itself (for example, the approved project against itself) needs only one read
+    same_project = str(prjid) == str(other_prjid)
+    if not same_project:
+        otr = licco_db[line_config_db_name]["projects"].find_one(
+            {"_id": ObjectId(other_prjid)})
+        if not otr:
+            return False, f"Cannot find project for {other_prjid}", None
 
     myfcs = get_project_attributes(licco_db[line_config_db_name], prjid)
-    thfcs = get_project_attributes(licco_db[line_config_db_name], other_prjid)
+    thfcs = myfcs if same_project else get_project_attributes(licco_db[line_config_db_name], other_prjid)
 
     myflat = __flatten__(myfcs)
     thflat = __flatten__(thfcs)
 
     mydict = {x[0]: x[1] for x in myflat}
     thdict = {x[0]: x[1] for x in thflat}
-    mykeys = set(mydict.keys())
-    thkeys = set(thdict.keys())
-    keys_u = mykeys.union(thkeys)
-    keys_i = mykeys.intersection(thkeys)
-    keys_l = mykeys - thkeys
-    keys_r = thkeys - mykeys
-
+    # Nothing differs; skip the per-key comparisons
+    if mydict == thdict:
+        return True, "", [{"diff": False, "key": k, "my": v, "ot": v} for k, v in sorted(mydict.items())]
     diff = []
-    for k in keys_u:
+    # Set operations directly on the key views; no need to copy the keys into sets first
+    for k in mydict.keys() | thdict.keys():
         # skip keys that exist in the approved project, but not in submitted project
-        if approved and (k in keys_r):
+        if approved and (k not in mydict):
             continue
-        if k in keys_i and mydict[k] == thdict[k]:
+        if k in mydict and k in thdict and mydict[k] == thdict[k]:
             diff.append({"diff": False, "key": k,
                         "my": mydict[k], "ot": thdict[k]})
         else:
@@ -945,9 +1102,7 @@ def create_empty_project(name, description, logged_in_user):
     """
     Empty project with name project name ands description
     """
-    prjid = licco_db[line_config_db_name]["projects"].insert_one({"name": name, "description": description, "owner": logged_in_user, "editors": [
-    ], "status": "development", "creation_time": datetime.datetime.utcnow()}).inserted_id
-    return get_project(prjid)
+    return create_new_project(name, description, logged_in_user)
 
 
 def update_project_details(prjid, prjdetails):
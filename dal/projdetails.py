@@ -7,6 +7,59 @@ from pymongo.errors import PyMongoError
 
 logger = logging.getLogger(__name__)
 
+# Only the initial $match depends on the project; the rest of these pipelines is the same for every call.
+project_attributes_stages = [
+    { "$sort": { "time": -1 }},
+    { "$group": {
+        "_id": {"fft": "$fft", "key": "$key"},
+        "latestkey": {"$first":  "$key"},
+        "latestval": {"$first":  "$val"}
+    }},
+    { "$project": {
+        "prj": "$prj",
+        "fft": "$_id.fft",
+        "latestkey": "$latestkey",
+        "latestval": "$latestval",
+    }},
+    { "$lookup": { "from": "ffts", "localField": "fft", "foreignField": "_id", "as": "fftobj"}},
+    { "$unwind": "$fftobj" },
+    {"$lookup": { "from": "fcs", "localField": "fftobj.fc", "foreignField": "_id", "as": "fcobj" }},
+    {"$unwind": "$fcobj"},
+    {"$lookup": { "from": "fgs", "localField": "fftobj.fg", "foreignField": "_id", "as": "fgobj" }},
+    {"$unwind": "$fgobj"},
+    # Only the names are used from the joined documents; drop the rest before sorting
+    { "$project": {
+        "prj": 1,
+        "fft": 1,
+        "fc": "$fcobj.name",
+        "fg": "$fgobj.name",
+        "latestkey": 1,
+        "latestval": 1
+    }},
+    { "$sort": {"prj": 1, "fc": 1, "fg": 1, "latestkey": 1}}
+]
+
+project_changes_stages = [
+    { "$sort": { "time": -1 }},
+    { "$lookup": { "from": "projects", "localField": "prj", "foreignField": "_id", "as": "prjobj"}},
+    { "$unwind": "$prjobj" },
+    { "$lookup": { "from": "ffts", "localField": "fft", "foreignField": "_id", "as": "fftobj"}},
+    { "$unwind": "$fftobj" },
+    {"$lookup": { "from": "fcs", "localField": "fftobj.fc", "foreignField": "_id", "as": "fcobj" }},
+    {"$unwind": "$fcobj"},
+    { "$lookup": { "from": "fgs", "localField": "fftobj.fg", "foreignField": "_id", "as": "fgobj" }},
+    { "$unwind": "$fgobj"},
+    { "$project": {
+        "prj": "$prjobj.name",
+        "fc": "$fcobj.name",
+        "fg": "$fgobj.name",
+        "key": "$key",
+        "val": "$val",
+        "user": "$user",
+        "time": "$time"
+    }},
+]
+
 def get_project_attributes(propdb, projectid, skipClonedEntries=False, asoftimestamp=None):
     project = propdb["projects"].find_one({"_id": ObjectId(projectid)})
     if not project:
@@ -19,33 +72,12 @@ def get_project_attributes(propdb, projectid, skipClonedEntries=False, asoftimes
     if asoftimestamp:
         mtch["$match"]["$and"].append({"time": {"$lte": asoftimestamp}})
 
-    histories = [ x for x in propdb["projects_history"].aggregate([
-        mtch,
-        { "$sort": { "time": -1 }},
-        { "$group": {
-            "_id": {"fft": "$fft", "key": "$key"},
-            "latestkey": {"$first":  "$key"},
-            "latestval": {"$first":  "$val"}
-        }},
-        { "$project": {
-            "prj": "$prj",
-            "fft": "$_id.fft",
-            "latestkey": "$latestkey",
-            "latestval": "$latestval",
-        }},
-        { "$lookup": { "from": "ffts", "localField": "fft", "foreignField": "_id", "as": "fftobj"}},
-        { "$unwind": "$fftobj" },
-        {"$lookup": { "from": "fcs", "localField": "fftobj.fc", "foreignField": "_id", "as": "fcobj" }},
-        {"$unwind": "$fcobj"},
-        {"$lookup": { "from": "fgs", "localField": "fftobj.fg", "foreignField": "_id", "as": "fgobj" }},
-        {"$unwind": "$fgobj"},
-        { "$sort": {"prj": 1, "fcobj.name": 1, "fgobj.name": 1, "latestkey": 1}}
-    ])]
+    histories = [ x for x in propdb["projects_history"].aggregate([mtch] + project_attributes_stages)]
     details = {}
     for hist in histories:
-        fft = str(hist["fftobj"]["_id"])
+        fft = str(hist["fft"])
         if fft not in details:
-            details[fft] = { "fft": { "_id": fft, "fc": hist["fcobj"]["name"], "fg": hist["fgobj"]["name"] } }
+            details[fft] = { "fft": { "_id": fft, "fc": hist["fc"], "fg": hist["fg"] } }
         details[fft][hist["latestkey"]] = hist["latestval"]
     return details
 
@@ -58,25 +90,5 @@ def get_all_project_changes(propdb, projectid):
 
     mtch = { "$match": {"$and": [ { "prj": ObjectId(projectid)} ]}}
 
-    histories = [ x for x in propdb["projects_history"].aggregate([
-        mtch,
-        { "$sort": { "time": -1 }},
-        { "$lookup": { "from": "projects", "localField": "prj", "foreignField": "_id", "as": "prjobj"}},
-        { "$unwind": "$prjobj" },
-        { "$lookup": { "from": "ffts", "localField": "fft", "foreignField": "_id", "as": "fftobj"}},
-        { "$unwind": "$fftobj" },
-        {"$lookup": { "from": "fcs", "localField": "fftobj.fc", "foreignField": "_id", "as": "fcobj" }},
-        {"$unwind": "$fcobj"},
-        { "$lookup": { "from": "fgs", "localField": "fftobj.fg", "foreignField": "_id", "as": "fgobj" }},
-        { "$unwind": "$fgobj"},
-        { "$project": {
-            "prj": "$prjobj.name",
-            "fc": "$fcobj.name",
-            "fg": "$fgobj.name",
-            "key": "$key",
-            "val": "$val",
-            "user": "$user",
-            "time": "$time"
-        }},
-    ])]
+    histories = [ x for x in propdb["projects_history"].aggregate([mtch] + project_changes_stages)]
     return histories
@@ -8,8 +8,7 @@ import os
 import fnmatch
 import re
 from io import BytesIO, StringIO
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
 import copy
 import tempfile
 from functools import wraps
@@ -23,9 +22,9 @@ from dal.licco import get_fcattrs, get_project, get_project_ffts, get_fcs, \
     create_new_functional_component, update_fft_in_project, submit_project_for_approval, approve_project, \
     get_currently_approved_project, diff_project, FCState, clone_project, get_project_changes, \
     get_tags_for_project, add_project_tag, get_all_projects, get_all_users, update_project_details, get_project_by_name, \
-    create_empty_project, reject_project, copy_ffts_from_project, get_fgs, create_new_fungible_token, get_ffts, create_new_fft, \
+    create_empty_project, reject_project, copy_ffts_from_project, get_fgs, create_new_fungible_token, get_ffts, create_new_fft, create_new_ffts, \
     get_projects_approval_history, delete_fft, delete_fc, delete_fg, get_project_attributes, validate_insert_range, get_fft_values_by_project, \
-    get_users_with_privilege, get_fft_name_by_id, get_fft_id_by_names
+    get_users_with_privilege, get_fft_name_by_id, get_fft_id_by_names, update_multiple_ffts_in_project, required_dimension_attrs
 
 
 __author__ = 'mshankar@slac.stanford.edu'
@@ -52,7 +51,21 @@ KEYMAP = {
     "LCLS_Z_roll": "nom_ang_z",
     "Must_Ray_Trace": "ray_trace"
 }
-KEYMAP_REVERSE = {value: key for key, value in KEYMAP.items()}
+# The export writes every KEYMAP column, in this order
+EXPORT_HEADERS = tuple(KEYMAP.keys())
+EXPORT_ATTRS = tuple(KEYMAP.values())
+# The FC attribute metadata is read-only here; look it up once rather than deep copying it for every validated FFT
+FCATTRS = get_fcattrs(fromstr=True)
+FCATTR_PARSERS = {name: meta["fromstr"] for name, meta in FCATTRS.items()}
+# Headers that every FFT needs, and the ones a non-conceptual FFT needs in addition to those
+REQUIRED_HEADERS = frozenset(name for name, meta in FCATTRS.items() if meta["required"])
+NONCONCEPTUAL_REQUIRED_HEADERS = REQUIRED_HEADERS | frozenset(required_dimension_attrs)
+# Curly quotes that get pasted into FC names in spreadsheets
+UNICODE_QUOTES = re.compile(u'[\u201c\u201d\u2018\u2019]')
+# Import reports are written here by create_logger and served from here by svc_download_report
+IMPORT_LOG_DIR = f"{tempfile.gettempdir()}/mcd"
+# Flush the CSV export to the client every so many characters
+EXPORT_CHUNK_SIZE = 64 * 1024
 
 
 def logAndAbort(error_msg, ret_status=500):
@@ -90,83 +103,115 @@ def create_imp_msg(fft, status, errormsg=None):
         res = "SUCCESS"
     else:
         res = "FAIL"
-    if 'fc' not in fft:
-        fft['fc'] = "NO VALID FC"
-    if 'fg' not in fft:
-        fft['fg'] = ''
-    msg = f"{res}: {fft['fc']}-{fft['fg']} - {errormsg}"
+    msg = f"{res}: {fft.get('fc', 'NO VALID FC')}-{fft.get('fg', '')} - {errormsg}"
     return msg
 
-def update_ffts_in_project(prjid, ffts, def_logger=None):
+def values_in_range(fcupdate):
+    """
+    Helper function to check that every value in an FFT update converts and is within bounds.
+    These are the same checks the update itself makes before anything is written.
+    """
+    for attr, val in fcupdate.items():
+        try:
+            newval = FCATTR_PARSERS[attr](val)
+        except (ValueError, KeyError):
+            return False
+        if not validate_insert_range(attr, newval):
+            return False
+    return True
+
+def update_ffts_in_project(prjid, ffts, def_logger=None, return_ffts=True):
     """
     Insert multiple FFTs into a project
+    Set return_ffts to False if the caller does not use the updated project FFTs; None is returned in their place.
     """
     if def_logger is None:
         def_logger = logger
     userid = context.security.get_current_user_id()
     update_status = {"success": 0, "fail": 0, "ignored": 0}
     if isinstance(ffts, dict):
-        new_ffts = []
-        for entry in ffts:
-            new_ffts.append(ffts[entry])
-        ffts = new_ffts
+        ffts = list(ffts.values())
+    # The current values of all the FFTs in the project; read once for the whole set
+    prj_ffts = get_project_ffts(prjid)
+    # The values of each FFT as they will be once the rows accepted so far are applied;
+    # so that a later row for the same FFT is defaulted and validated against these
+    running_values = {}
+    # The names of each FFT along with its validation error, if any; reported in order once the updates are done
+    imp_msgs = []
+    fftupdates = []
     # Iterate through parameter fft set
     for fft in ffts:
-        if "_id" not in fft:
+        # Work on a copy; the ffts passed in (for example, straight from get_project_ffts) are left as is
+        fcupdate = dict(fft)
+        if "_id" not in fcupdate:
             # If the fft set comes from the database, unpack the fft ids
-            if "fft" in fft:
-                fft["_id"] = fft["fft"]["_id"]
-                fft["fc"] = fft["fft"]["fc"]
-                fft["fg"] = fft["fft"]["fg"]
+            if "fft" in fcupdate:
+                fcupdate["_id"] = fft["fft"]["_id"]
+                fcupdate["fc"] = fft["fft"]["fc"]
+                fcupdate["fg"] = fft["fft"]["fg"]
             # Otherwise, look up the fft ids
             else:
-                if "fg" not in fft:
-                    fft["fg"] = ""
-                fft["_id"] = get_fft_id_by_names(fc=fft["fc"], fg=fft["fg"])
-        fftid = fft["_id"]
-        # previous values
-        db_values = get_fft_values_by_project(fft["_id"], prjid)
-        fcupdate = {}
-        fcupdate.update(fft)   
+                if "fg" not in fcupdate:
+                    fcupdate["fg"] = ""
+                fcupdate["_id"] = get_fft_id_by_names(fc=fcupdate["fc"], fg=fcupdate["fg"])
+        fftid = fcupdate["_id"]
+        # The names are needed for the import report after they have been stripped from the update
+        fftnames = {attr: fcupdate[attr] for attr in ["fc", "fg"] if attr in fcupdate}
+        # previous values, including those from earlier rows for the same FFT
+        db_values = running_values.get(str(fftid)) or prj_ffts.get(str(fftid), {})
         if ("state" not in fcupdate) or (not fcupdate["state"]):
             if "state" in db_values:
                 fcupdate["state"] = db_values["state"]
             else:
                 fcupdate["state"] = "Conceptual"
         # If invalid, don't try to add to DB
-        status, errormsg = validate_import_headers(fcupdate, prjid, fftid)
+        status, errormsg = validate_import_headers(fcupdate, prjid, fftid, db_values=db_values)
         if not status:
             update_status["fail"] += 1
-            def_logger.info(create_imp_msg(fft, False, errormsg=errormsg))
+            imp_msgs.append((fftnames, errormsg))
             continue
         for attr in ["_id", "name", "fc", "fg", "fft"]:
             if attr in fcupdate:
                 del fcupdate[attr]
-        status, errormsg, prj_fft, results = update_fft_in_project(
-            prjid, fftid, fcupdate, userid)
+        imp_msgs.append((fftnames, None))
+        fftupdates.append((fftid, fcupdate))
+        # Rows that the update will reject are not written; so later rows must not build on them
+        if values_in_range(fcupdate):
+            running_values[str(fftid)] = {**db_values, **fcupdate}
+
+    status, errormsg, prj_ffts, results = update_multiple_ffts_in_project(
+        prjid, fftupdates, userid, project_attrs=prj_ffts, refresh_attrs=return_ffts)
+    results = iter(results)
+    for fftnames, validation_error in imp_msgs:
+        if validation_error:
+            def_logger.info(create_imp_msg(fftnames, False, errormsg=validation_error))
+            continue
+        fft_status, fft_errormsg, fft_results = next(results)
         # Have smarter error handling here for different exit conditions
-        def_logger.info(create_imp_msg(fft, status=status, errormsg=errormsg))
- 
+        def_logger.info(create_imp_msg(fftnames, status=fft_status, errormsg=fft_errormsg))
         # Add the individual FFT update results into overall count
-        if results:
-            update_status = {k: update_status[k]+results[k]
+        if fft_results:
+            update_status = {k: update_status[k]+fft_results[k]
                              for k in update_status.keys()}
-    return True, errormsg, get_project_ffts(prjid, showallentries=True, asoftimestamp=None), update_status
+    return True, errormsg, prj_ffts, update_status
 
 
-def validate_import_headers(fft, prjid, fftid=None):
+def validate_import_headers(fft, prjid, fftid=None, db_values=None):
     """
     Helper function to pre-validate that all required data is present
+    Pass in db_values if the current values of the FFT in the project have already been fetched.
     """
-    attrs = get_fcattrs(fromstr=True)
+    attrs = FCATTRS
     if not fftid:
         fftid = fft["_id"]
-    db_values = get_fft_values_by_project(fftid, prjid)
+    if db_values is None:
+        db_values = get_fft_values_by_project(fftid, prjid)
     if not "state" in fft:
         fft["state"] = db_values["state"]
+    # Headers required for all, plus the dimensions if the FFT is non-conceptual
+    required = REQUIRED_HEADERS if fft["state"] == "Conceptual" else NONCONCEPTUAL_REQUIRED_HEADERS
     for header in attrs:
-        # If header is required for all, or if the FFT is non-conceptual and header is required
-        if attrs[header]["required"] or ((fft["state"] != "Conceptual") and ("is_required_dimension" in attrs[header] and attrs[header]["is_required_dimension"] == True)):
+        if header in required:
             # If required header not present in upload dataset
             if not header in fft:
                 # Check if in DB already, continue to validate next if so
@@ -185,7 +230,7 @@ def validate_import_headers(fft, prjid, fftid=None):
         if not header in fft:
             continue
         try:
-            val = attrs[header]["fromstr"](fft[header])
+            val = FCATTR_PARSERS[header](fft[header])
         except (ValueError, KeyError) as e:
             error_str = f"Invalid Data {fft[header]} For Type of {header}."
             return False, error_str
@@ -212,16 +257,15 @@ def create_logger(logname):
     """
     Create and return a logger that writes to a provided file
     """
-    dir_path = f"{tempfile.gettempdir()}/mcd"
-    if not os.path.exists(dir_path):
-        os.mkdir(dir_path)
+    os.makedirs(IMPORT_LOG_DIR, exist_ok=True)
     # create a file 
-    handler = logging.FileHandler(f'{dir_path}/{logname}.log')
-    logger.debug(f"Creating log file {dir_path}/{logname}.log")
+    handler = logging.FileHandler(f'{IMPORT_LOG_DIR}/{logname}.log')
+    logger.debug("Creating log file %s/%s.log", IMPORT_LOG_DIR, logname)
 
-    new_logger = logging.getLogger(logname)
+    # Every import gets a uniquely named logger; creating it directly keeps it out of the
+    # logging manager's registry, which would otherwise hold on to it for the life of the process.
+    new_logger = logging.Logger(logname, level=logging.DEBUG)
     new_logger.addHandler(handler)
-    new_logger.propagate = False
     return new_logger, handler
 
 @licco_ws_blueprint.route("/enums/<enumName>", methods=["GET"])
@@ -350,7 +394,7 @@ def svc_get_project_ffts(prjid):
     asoftimestampstr = request.args.get("asoftimestamp", None)
     if asoftimestampstr:
         asoftimestamp = datetime.strptime(
-            asoftimestampstr, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=pytz.UTC)
+            asoftimestampstr, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
     else:
         asoftimestamp = None
     project_fcs = get_project_ffts(
@@ -370,8 +414,7 @@ def svc_get_project_ffts(prjid):
     }
     for attrname, lmda in filt2fn.items():
         if request.args.get(attrname, None):
-            logger.info("Applying filter for " + attrname +
-                        " " + request.args.get(attrname, ""))
+            logger.info("Applying filter for %s %s", attrname, request.args.get(attrname, ""))
             project_fcs = __filter__(lmda, project_fcs)
 
     return JSONEncoder().encode({"success": True, "value": project_fcs})
@@ -519,8 +562,8 @@ def svc_sync_fc_from_approved_in_project(prjid, fftid):
     userid = context.security.get_current_user_id()
     reqparams = request.json
     logger.info(reqparams)
-    status, errormsg, fc = copy_ffts_from_project(destprjid=prjid, srcprjid=reqparams["other_id"], fftid=fftid, attrnames=[
-        x["name"] for x in get_fcattrs()] if reqparams["attrnames"] == "ALL" else reqparams["attrnames"], userid=userid)
+    status, errormsg, fc = copy_ffts_from_project(destprjid=prjid, srcprjid=reqparams["other_id"], fftid=fftid, attrnames=list(
+        FCATTRS) if reqparams["attrnames"] == "ALL" else reqparams["attrnames"], userid=userid)
     return JSONEncoder().encode({"success": status, "errormsg": errormsg, "value": fc})
 
 
@@ -591,14 +634,15 @@ def svc_import_project(prjid):
                 fcs[line["FC"]].append(line)
             else:
                 # Sanitize/replace unicode quotes
-                clean_line = re.sub(
-                    u'[\u201c\u201d\u2018\u2019]', '', line["FC"])
+                clean_line = UNICODE_QUOTES.sub('', line["FC"])
                 if not clean_line:
                     status_val["fail"] += 1
                     continue
                 fcs[clean_line] = [line]
         if not fcs:
             return {"status_str": "Import Error: No data detected in import file.", "log_name": None}
+        # Every row has the same columns, so work out the recognized ones just once
+        import_columns = [(k, v) for k, v in KEYMAP.items() if k in reader.fieldnames]
 
     log_time = datetime.now().strftime("%m%d%Y.%H%M%S")
     log_name = f"{context.security.get_current_user_id()}_{prj_name.replace('/', '_')}_{log_time}"
@@ -609,7 +653,7 @@ def svc_import_project(prjid):
 
     fc2id = {
         value["name"]: value["_id"]
-        for value in json.loads(svc_get_fcs())["value"]
+        for value in get_fcs()
     }
 
     for nm, fc_list in fcs.items():
@@ -635,7 +679,7 @@ def svc_import_project(prjid):
 
     fg2id = {
         fgs["name"]: fgs["_id"]
-        for fgs in json.loads(svc_get_fgs())["value"]
+        for fgs in get_fgs()
     }
 
     for nm, fc_list in fcs.items():
@@ -647,27 +691,24 @@ def svc_import_project(prjid):
 
     ffts = {(fft["fc"]["name"], fft["fg"]["name"]): fft["_id"]
             for fft in get_ffts()}
-    for fc_list in fcs.values():
-        for fc in fc_list:
-            if (fc["FC"], fc["Fungible"]) not in ffts:
-                status, errormsg, newfft = create_new_fft(
-                    fc=fc["FC"], fg=fc["Fungible"], fcdesc=None, fgdesc=None)
-                ffts[(newfft["fc"]["name"], newfft["fg"]["name"]
-                      if "fg" in newfft else None)] = newfft["_id"]
+    # Register all the FFTs that are new to this import in one go
+    missing_ffts = {(fc["FC"], fc["Fungible"]) for fc_list in fcs.values() for fc in fc_list} - ffts.keys()
+    ffts.update(create_new_ffts(missing_ffts))
 
     fcuploads = []
     for nm, fc_list in fcs.items():
         for fc in fc_list:
-            fcupload = {}
+            if (fc["FC"], fc["Fungible"]) not in ffts:
+                status_val["fail"] += 1
+                imp_log.info(f"Import for fft {fc['FC']}-{fc['Fungible']} failed: Could not register the FFT")
+                continue
+            fcupload = {v: fc[k] for k, v in import_columns}
             fcupload["_id"] = ffts[(fc["FC"], fc["Fungible"])]
-            for k, v in KEYMAP.items():
-                if k not in fc:
-                    continue
-                fcupload[v] = fc[k]
             fcuploads.append(fcupload)
 
+    # The import only reports the counts, so skip reading back the project FFTs
     status, errormsg, fft, update_status = update_ffts_in_project(
-        prjid, fcuploads, imp_log)
+        prjid, fcuploads, imp_log, return_ffts=False)
 
     # Include imports failed from bad FC/FGs
     prj_name = get_project(prjid)["name"]
@@ -675,8 +716,7 @@ def svc_import_project(prjid):
         status_val = {k: update_status[k]+status_val[k]
                             for k in update_status.keys()}
         
-    # number of recognized headers minus the id used for DB reference
-    status_val["headers"] = len(fcuploads[0].keys())-1
+    status_val["headers"] = len(import_columns)
     status_str = create_status_update(prj_name, status_val)
     logger.debug(re.sub('\n|_', '', status_str))
     imp_log.info(status_str)
@@ -693,10 +733,8 @@ def svc_download_report(report):
 
     :param: report- full filename of single import log file
     """
-    #This is set in the create_logger function-need to be identical paths
-    dir_path = f"{tempfile.gettempdir()}/mcd"
     try:
-        repfile = f"{dir_path}/{report}.log"
+        repfile = f"{IMPORT_LOG_DIR}/{report}.log"
         return send_file(f"{repfile}",as_attachment=True,mimetype="text/plain")
     except FileNotFoundError:
         return JSONEncoder().encode({"success": False, "errormsg": "Something went wrong.", "value": None}) 
@@ -705,31 +743,28 @@ def svc_download_report(report):
 @context.security.authentication_required
 def svc_export_project(prjid):
     """
-    Export project into a cvs that downloads
+    Export project into a cvs that downloads.
+    Rows are written straight from the project attributes and streamed back in chunks.
     """
-    with StringIO() as stream:
-        writer = csv.DictWriter(stream, fieldnames=KEYMAP.keys())
-        writer.writeheader()
-        prj_ffts = get_project_ffts(prjid)
-        prj_name = get_project(prjid)["name"]
-
-        for fft in prj_ffts:
-            row_dict = {}
-            fft_dict = prj_ffts[fft]
-            for key in fft_dict:
-                if key == "fft":
-                    continue
-                row_dict[KEYMAP_REVERSE[key]] = fft_dict[key]
-            for key in fft_dict["fft"]:
-                if key == "_id":
-                    continue
-                row_dict[KEYMAP_REVERSE[key]] = fft_dict["fft"][key]
-
-            writer.writerow(row_dict)
-
-        csv_string = stream.getvalue()
-
-    return Response(csv_string, mimetype="text/csv", headers={"Content-disposition": f"attachment; filename={prj_name}.csv"})
+    prj_name = get_project(prjid)["name"]
+    prj_ffts = get_project_ffts(prjid)
+
+    def __generate_csv__():
+        with StringIO() as stream:
+            writer = csv.writer(stream, lineterminator="\n")
+            writer.writerow(EXPORT_HEADERS)
+            for fft_dict in prj_ffts.values():
+                # The fc and fg names live in the nested fft object; everything else is a project attribute
+                fft = fft_dict["fft"]
+                row = dict(fft_dict, fc=fft.get("fc", ""), fg=fft.get("fg", ""))
+                writer.writerow([row.get(attr, "") for attr in EXPORT_ATTRS])
+                if stream.tell() >= EXPORT_CHUNK_SIZE:
+                    yield stream.getvalue()
+                    stream.seek(0)
+                    stream.truncate()
+            yield stream.getvalue()
+
+    return Response(__generate_csv__(), mimetype="text/csv", headers={"Content-disposition": f"attachment; filename={prj_name}.csv"})
 
 
 @licco_ws_blueprint.route("/projects/<prjid>/submit_for_approval",
@@ -848,10 +883,9 @@ def svc_add_project_tag(prjid):
         changes = get_project_changes(prjid)
         if not changes:
             return JSONEncoder().encode({"success": False, "errormsg": "Cannot tag a project without a change", "value": None})
-        logger.info("Latest change is at " + str(changes[0]["time"]))
+        logger.info("Latest change is at %s", changes[0]["time"])
         asoftimestamp = changes[0]["time"]
-    logger.debug(
-        f"Adding a tag for {prjid} at {asoftimestamp} with name {tagname}")
+    logger.debug("Adding a tag for %s at %s with name %s", prjid, asoftimestamp, tagname)
     status, errormsg, tags = add_project_tag(prjid, tagname, asoftimestamp)
     return JSONEncoder().encode({"success": status, "errormsg": errormsg, "value": tags})
 